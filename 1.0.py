@@ -1,23 +1,76 @@
-from flask import Flask, request, render_template_string, jsonify, session, send_file
+from flask import Flask, Response, request, render_template_string, jsonify, session
 from datetime import datetime
 import threading
 import time
 import json
 import io
 import csv
-from collections import defaultdict
-from colorama import init, Fore, Style
+import os
+import sys
+from collections import defaultdict, OrderedDict
 import secrets
 
-# 初始化颜色输出
-init(autoreset=True)
+# 默认配置，create_app(config)传入的同名键会覆盖这些值
+DEFAULT_CONFIG = {
+    'SECRET_KEY': None,  # 未设置时每次启动随机生成
+    'ADMIN_PASSWORD': '123456',
+    'LOG_ENABLED': True,  # 是否在控制台输出彩色访问日志
+    'TRAFFIC_ENABLED': True,  # 是否在WSGI层按路由统计流量
+    'CLUSTER_TOKEN': None,  # 集群接口的共享密钥，未设置时集群接口关闭
+    'AGGREGATE': False,  # 是否以聚合模式合并其他节点的数据
+    'PEERS': [],  # 聚合模式下定期拉取的节点地址
+    'PUSH_TO': None,  # 定期推送增量快照的聚合节点地址
+    'SYNC_INTERVAL': 5,  # 集群同步间隔（秒）
+    'NODE_NAME': None,  # 推送快照时附带的节点名称，聚合节点据此识别重启后的同一节点，各节点必须不同
+}
 
-app = Flask(__name__)
-app.secret_key = secrets.token_hex(16)
+# 小于该字节数的响应不值得压缩
+COMPRESS_MIN_SIZE = 512
 
-# 全局变量存储统计数据
+# 管理接口单次最多返回的历史数据点
+MAX_HISTORY_POINTS = 24 * 60
+
+# 路由流量统计：状态码计数表的大小和请求速率的时间窗口（秒）
+STATUS_CODE_SLOTS = 600
+RATE_WINDOW = 60
+
+# 导入模块并创建应用的耗时预算（毫秒），实测中位数约180ms
+STARTUP_BUDGET_MS = 300
+
+_colors = None
+
+def colors():
+    """首次输出彩色日志时才导入并初始化colorama"""
+    global _colors
+    if _colors is None:
+        from colorama import init, Fore, Style
+        init(autoreset=True)
+        _colors = (Fore, Style)
+    return _colors
+
+_brotli = False  # False表示尚未尝试导入
+
+def brotli_module():
+    """首次压缩响应时才尝试导入可选的brotli，未安装时返回None"""
+    global _brotli
+    if _brotli is False:
+        try:
+            import brotli
+        except ImportError:
+            brotli = None
+        _brotli = brotli
+    return _brotli
+
+# 分钟级汇总桶最多保留24小时
+ROLLUP_MAX_BUCKETS = 24 * 60
+
+# 节点超过这么多个同步间隔没有更新时，不再计入它的活跃连接数
+NODE_STALE_INTERVALS = 3
+
+# 统计数据（每个应用实例各自持有一份）
 class Statistics:
-    def __init__(self):
+    def __init__(self, log_enabled=True):
+        self.log_enabled = log_enabled
         self.active_connections = 0
         self.total_requests = 0
         self.total_data_transferred = 0  # 字节
@@ -28,6 +81,40 @@ class Statistics:
         self.lock = threading.Lock()
         self.connection_timestamps = defaultdict(list)
         
+        # 集群快照相关：节点ID、变更版本号以及按版本排序的脏记录
+        self.node_id = secrets.token_hex(8)
+        self.version = 0
+        self.user_index = {}  # ip -> user_data中的记录
+        self.user_versions = OrderedDict()  # ip -> 最后修改版本
+        self.rollup = {}  # 分钟时间戳 -> [请求数, 字节数, 峰值连接数]
+        self.rollup_versions = OrderedDict()  # 分钟时间戳 -> 最后修改版本
+        
+    def _touch_user(self, ip):
+        # 调用方需持有锁
+        self.version += 1
+        self.user_versions[ip] = self.version
+        self.user_versions.move_to_end(ip)
+    
+    def _touch_rollup(self, requests=0, bytes_transferred=0):
+        # 调用方需持有锁，按分钟聚合请求数和流量
+        minute = int(time.time()) // 60 * 60
+        bucket = self.rollup.get(minute)
+        if bucket is None:
+            bucket = self.rollup[minute] = [0, 0, 0]
+        bucket[0] += requests
+        bucket[1] += bytes_transferred
+        bucket[2] = max(bucket[2], self.active_connections)
+        
+        self.version += 1
+        self.rollup_versions[minute] = self.version
+        self.rollup_versions.move_to_end(minute)
+        
+        # 只保留最近24小时的分钟桶
+        while len(self.rollup) > ROLLUP_MAX_BUCKETS:
+            oldest = min(self.rollup)
+            del self.rollup[oldest]
+            self.rollup_versions.pop(oldest, None)
+    
     def add_connection(self, ip, user_agent, location=None):
         with self.lock:
             self.active_connections += 1
@@ -43,13 +130,16 @@ class Statistics:
             }
             
             # 检查是否已存在该IP
-            existing = next((u for u in self.user_data if u['ip'] == ip), None)
+            existing = self.user_index.get(ip)
             if existing:
                 existing['requests'] += 1
                 if location and location != '未知':
                     existing['location'] = location
             else:
                 self.user_data.append(user_info)
+                self.user_index[ip] = user_info
+            self._touch_user(ip)
+            self._touch_rollup(requests=1)
             
             # 记录历史数据
             now = datetime.now()
@@ -90,9 +180,47 @@ class Statistics:
                 'time': datetime.now(),
                 'bytes': self.total_data_transferred
             })
+            self._touch_rollup(bytes_transferred=bytes_transferred)
             return self.log_message(ip, None, None, '数据传输', bytes_transferred)
     
+    def update_location(self, ip, location):
+        with self.lock:
+            user = self.user_index.get(ip)
+            if user:
+                user['location'] = location
+                self._touch_user(ip)
+    
+    def export_snapshot(self, since=0):
+        """导出自版本 since 以来的增量快照（since=0 时为全量）"""
+        with self.lock:
+            users = []
+            for ip, version in reversed(self.user_versions.items()):
+                if version <= since:
+                    break
+                user = self.user_index[ip]
+                users.append([ip, user['user_agent'], user['location'],
+                              user['timestamp'].timestamp(), user['requests']])
+            
+            buckets = []
+            for minute, version in reversed(self.rollup_versions.items()):
+                if version <= since:
+                    break
+                buckets.append([minute] + self.rollup[minute])
+            
+            return {
+                'node': self.node_id,
+                'since': since,
+                'version': self.version,
+                'counters': [self.total_requests, self.total_data_transferred,
+                             self.active_connections],
+                'users': users,
+                'buckets': buckets
+            }
+    
     def log_message(self, ip, user_agent, location, msg_type, data_size=None):
+        if not self.log_enabled:
+            return None
+        Fore, Style = colors()
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         
         if msg_type == '连接请求':
@@ -108,7 +236,495 @@ class Statistics:
         print(message)
         return message
 
-stats = Statistics()
+
+def validate_snapshot(snapshot):
+    """检查来自其他节点的快照结构，不合法时抛出ValueError，保证合并时不会只应用一半"""
+    def is_int(value):
+        return isinstance(value, int) and not isinstance(value, bool)
+    
+    if not isinstance(snapshot, dict):
+        raise ValueError('快照必须是JSON对象')
+    if not isinstance(snapshot.get('node'), str) or not snapshot['node']:
+        raise ValueError('node无效')
+    for key in ('since', 'version'):
+        if not is_int(snapshot.get(key)) or snapshot[key] < 0:
+            raise ValueError(f'{key}无效')
+    if snapshot.get('source') is not None and not isinstance(snapshot['source'], str):
+        raise ValueError('source无效')
+    
+    counters = snapshot.get('counters')
+    if not (isinstance(counters, list) and len(counters) == 3 and all(map(is_int, counters))):
+        raise ValueError('counters无效')
+    
+    users = snapshot.get('users')
+    if not isinstance(users, list):
+        raise ValueError('users无效')
+    for row in users:
+        if not (isinstance(row, list) and len(row) == 5
+                and isinstance(row[0], str)
+                and (row[1] is None or isinstance(row[1], str))
+                and isinstance(row[2], str)
+                and isinstance(row[3], (int, float)) and not isinstance(row[3], bool)
+                and 0 <= row[3] < 1e11
+                and is_int(row[4])):
+            raise ValueError('users中的记录无效')
+    
+    buckets = snapshot.get('buckets')
+    if not isinstance(buckets, list):
+        raise ValueError('buckets无效')
+    for row in buckets:
+        if not (isinstance(row, list) and len(row) == 4 and all(map(is_int, row))
+                and 0 <= row[0] < 1e11):
+            raise ValueError('buckets中的记录无效')
+
+
+class Aggregator:
+    """合并多个节点的统计快照，每次只应用增量部分"""
+    
+    def __init__(self, local_stats, peers=None, token=None, interval=5):
+        self.local_stats = local_stats
+        self.peers = list(peers or [])
+        self.token = token
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.nodes = {}  # 节点ID -> 该节点的最新状态
+        self.sources = {}  # 对等节点URL或推送方名称 -> 当前节点ID
+        self.cursors = {}  # 对等节点URL -> 已拉取到的版本
+        # 合并后的结果，随增量一起更新
+        self.counters = [0, 0, 0]
+        self.users = {}  # ip -> [user_agent, location, timestamp, requests]
+        self.buckets = defaultdict(lambda: [0, 0, 0])
+        self._thread = None
+    
+    def known_version(self, node):
+        with self.lock:
+            state = self.nodes.get(node)
+            return state['version'] if state else 0
+    
+    def apply_snapshot(self, snapshot, source=None):
+        """应用一个增量快照，若与已知版本不连续则返回False；外部快照需先经过validate_snapshot"""
+        node = snapshot['node']
+        with self.lock:
+            state = self.nodes.get(node)
+            if state is None:
+                if snapshot['since'] != 0:
+                    return False
+                state = self.nodes[node] = {
+                    'version': 0,
+                    'counters': [0, 0, 0],
+                    'users': {},
+                    'buckets': {}
+                }
+            elif snapshot['since'] > state['version']:
+                return False
+            
+            for i, value in enumerate(snapshot['counters']):
+                self.counters[i] += value - state['counters'][i]
+            state['counters'] = list(snapshot['counters'])
+            
+            for ip, user_agent, location, timestamp, requests in snapshot['users']:
+                old = state['users'].get(ip)
+                old_requests = old[3] if old else 0
+                state['users'][ip] = [user_agent, location, timestamp, requests]
+                
+                merged = self.users.get(ip)
+                if merged is None:
+                    self.users[ip] = [user_agent, location, timestamp, requests]
+                    continue
+                merged[3] += requests - old_requests
+                if timestamp >= merged[2]:
+                    merged[0] = user_agent
+                    merged[1] = location
+                    merged[2] = timestamp
+            
+            for minute, requests, bytes_transferred, peak in snapshot['buckets']:
+                old = state['buckets'].get(minute, (0, 0, 0))
+                state['buckets'][minute] = (requests, bytes_transferred, peak)
+                merged = self.buckets[minute]
+                merged[0] += requests - old[0]
+                merged[1] += bytes_transferred - old[1]
+                merged[2] += peak - old[2]
+            
+            # 丢弃过旧的分钟桶，避免节点状态无限增长
+            if len(self.buckets) > ROLLUP_MAX_BUCKETS:
+                cutoff = sorted(self.buckets)[-ROLLUP_MAX_BUCKETS]
+                for minute in [m for m in self.buckets if m < cutoff]:
+                    del self.buckets[minute]
+                for other in self.nodes.values():
+                    for minute in [m for m in other['buckets'] if m < cutoff]:
+                        del other['buckets'][minute]
+            
+            state['version'] = max(state['version'], snapshot['version'])
+            state['seen'] = time.time()
+            
+            # 同一来源换了节点ID说明对方已重启，旧节点不再有活跃连接
+            if source is not None:
+                previous = self.sources.get(source)
+                if previous is not None and previous != node:
+                    self._retire(self.nodes[previous])
+                self.sources[source] = node
+            return True
+    
+    def _retire(self, state):
+        # 调用方需持有锁；节点已重启或下线，它的活跃连接数不再计入合并结果
+        self.counters[2] -= state['counters'][2]
+        state['counters'][2] = 0
+    
+    def retire_stale_nodes(self):
+        deadline = time.time() - NODE_STALE_INTERVALS * self.interval
+        with self.lock:
+            for node, state in self.nodes.items():
+                if node != self.local_stats.node_id and state['seen'] < deadline:
+                    self._retire(state)
+    
+    def pull(self, url):
+        since = self.cursors.get(url, 0)
+        snapshot = fetch_snapshot(url, since, self.token)
+        if not self.apply_snapshot(snapshot, source=url):
+            # 对等节点重启或版本不连续，从已确认的版本重新拉取
+            snapshot = fetch_snapshot(url, self.known_version(snapshot['node']), self.token)
+            if not self.apply_snapshot(snapshot, source=url):
+                return
+        self.cursors[url] = snapshot['version']
+    
+    def sync(self):
+        # 本节点也以增量方式参与合并
+        since = self.known_version(self.local_stats.node_id)
+        self.apply_snapshot(self.local_stats.export_snapshot(since))
+        for url in self.peers:
+            try:
+                self.pull(url)
+            except Exception as e:
+                Fore, Style = colors()
+                print(f"{Fore.RED}[集群]{Style.RESET_ALL} 拉取 {url} 失败: {e!r}")
+        self.retire_stale_nodes()
+    
+    def start(self):
+        def run():
+            while True:
+                try:
+                    self.sync()
+                except Exception as e:
+                    Fore, Style = colors()
+                    print(f"{Fore.RED}[集群]{Style.RESET_ALL} 同步失败: {e!r}")
+                time.sleep(self.interval)
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+    
+    def admin_data(self, points=30):
+        """返回合并后的管理面板数据，时间为datetime，结构与单节点一致"""
+        # 未启动后台线程时，在读取前同步一次
+        if self._thread is None:
+            self.sync()
+        with self.lock:
+            minutes = sorted(self.buckets)[-points:]
+            # 从总量倒推每个分钟桶结束时的累计值
+            request_history = []
+            data_history = []
+            total_requests, total_bytes = self.counters[0], self.counters[1]
+            for minute in reversed(minutes):
+                bucket = self.buckets[minute]
+                moment = datetime.fromtimestamp(minute)
+                request_history.append((moment, total_requests))
+                data_history.append((moment, total_bytes))
+                total_requests -= bucket[0]
+                total_bytes -= bucket[1]
+            request_history.reverse()
+            data_history.reverse()
+            
+            users = sorted(self.users.items(), key=lambda item: item[1][2])[-50:]
+            return {
+                'nodes': len(self.nodes),
+                'active_connections': self.counters[2],
+                'total_requests': self.counters[0],
+                'total_data_transferred': self.counters[1],
+                'connection_history': [(datetime.fromtimestamp(m), self.buckets[m][2])
+                                       for m in minutes],
+                'request_history': request_history,
+                'data_history': data_history,
+                'user_data': [(ip, user[1], user[0], datetime.fromtimestamp(user[2]), user[3])
+                              for ip, user in users]
+            }
+
+
+def to_millis(dt):
+    return int(dt.timestamp() * 1000)
+
+
+def delta_encode(values):
+    # 相邻数据点之差通常很小，编码后的JSON更短
+    encoded = []
+    previous = 0
+    for value in values:
+        encoded.append(value - previous)
+        previous = value
+    return encoded
+
+
+# 历史序列名称 -> 普通格式下数值字段的名称
+HISTORY_FIELDS = {
+    'connection_history': 'count',
+    'request_history': 'count',
+    'data_history': 'bytes',
+}
+
+
+def encode_admin_data(data, compact=False):
+    """
+    把管理面板数据编码为可序列化的结构
+
+    普通格式保持原有的逐点对象和ISO时间；紧凑格式按列存放，时间为毫秒时间戳，
+    历史序列的时间和数值都做差分编码，由面板脚本还原。
+    """
+    result = {key: value for key, value in data.items()
+              if key not in HISTORY_FIELDS and key not in ('user_data', 'routes')}
+    users = data['user_data']
+    routes = data['routes']
+    
+    if compact:
+        result['format'] = 'compact'
+        for key in HISTORY_FIELDS:
+            series = data[key]
+            result[key] = {
+                't': delta_encode([to_millis(t) for t, _ in series]),
+                'v': delta_encode([v for _, v in series])
+            }
+        result['user_data'] = {
+            'ip': [u[0] for u in users],
+            'location': [u[1] for u in users],
+            'user_agent': [u[2] for u in users],
+            'timestamp': [to_millis(u[3]) for u in users],
+            'requests': [u[4] for u in users]
+        }
+        result['routes'] = {
+            'route': [r[0] for r in routes],
+            'requests': [r[1] for r in routes],
+            'request_bytes': [r[2] for r in routes],
+            'response_bytes': [r[3] for r in routes],
+            'status': [r[4] for r in routes],
+            'rate': [r[5] for r in routes]
+        }
+        return result
+    
+    for key, field in HISTORY_FIELDS.items():
+        result[key] = [{'time': t.isoformat(), field: v} for t, v in data[key]]
+    result['user_data'] = [{
+        'ip': ip,
+        'location': location,
+        'user_agent': user_agent,
+        'timestamp': timestamp.isoformat(),
+        'requests': requests
+    } for ip, location, user_agent, timestamp, requests in users]
+    result['routes'] = [{
+        'route': route,
+        'requests': requests,
+        'request_bytes': request_bytes,
+        'response_bytes': response_bytes,
+        'status': status,
+        'rate': rate
+    } for route, requests, request_bytes, response_bytes, status, rate in routes]
+    return result
+
+
+def negotiate_encoding():
+    """按Accept-Encoding选择压缩方式，brotli未安装时只提供gzip"""
+    offered = ['br', 'gzip'] if brotli_module() is not None else ['gzip']
+    return request.accept_encodings.best_match(offered)
+
+
+def compress_response(response):
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate_encoding()
+    if encoding is None or response.direct_passthrough:
+        return response
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+    
+    if encoding == 'br':
+        data = brotli_module().compress(data, quality=5)
+    else:
+        import gzip
+        data = gzip.compress(data, compresslevel=6)
+    response.set_data(data)
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def default_node_name(port):
+    # 负载均衡后的实例通常监听相同的地址和端口，用主机名区分不同机器
+    import socket
+    return f"{socket.gethostname()}:{port}"
+
+
+def fetch_snapshot(url, since, token):
+    import urllib.request
+    req = urllib.request.Request(f"{url.rstrip('/')}/cluster/snapshot?since={since}",
+                                 headers={'X-Cluster-Token': token or ''})
+    with urllib.request.urlopen(req, timeout=5) as resp:
+        snapshot = json.loads(resp.read().decode('utf-8'))
+    validate_snapshot(snapshot)
+    return snapshot
+
+
+def push_snapshots(local_stats, url, token, interval, source=None):
+    """把本节点的增量快照周期性推送给聚合节点"""
+    import urllib.request
+    import urllib.error
+    
+    def push(since):
+        snapshot = local_stats.export_snapshot(since)
+        snapshot['source'] = source
+        req = urllib.request.Request(f"{url.rstrip('/')}/cluster/push",
+                                     data=json.dumps(snapshot).encode('utf-8'),
+                                     headers={'Content-Type': 'application/json',
+                                              'X-Cluster-Token': token or ''})
+        try:
+            with urllib.request.urlopen(req, timeout=5) as resp:
+                return json.loads(resp.read().decode('utf-8'))['version']
+        except urllib.error.HTTPError as e:
+            if e.code != 409:
+                raise
+            # 聚合节点的版本与本地不一致，从它确认的版本重新推送
+            return json.loads(e.read().decode('utf-8'))['version']
+    
+    def run():
+        since = 0
+        while True:
+            try:
+                since = push(since)
+            except Exception as e:
+                Fore, Style = colors()
+                print(f"{Fore.RED}[集群]{Style.RESET_ALL} 推送到 {url} 失败: {e!r}")
+            time.sleep(interval)
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+class RouteTraffic:
+    """按路由统计请求数、请求/响应字节数、状态码和每秒请求数，计数器在创建时一次性分配"""
+    
+    def __init__(self, routes):
+        # routes为(端点名, 路由规则)列表，最后一个槽位留给未匹配任何路由的请求
+        self.labels = [rule for _, rule in routes] + ['(未匹配)']
+        self.index = {endpoint: slot for slot, (endpoint, _) in enumerate(routes)}
+        self.unmatched = len(routes)
+        
+        slots = len(self.labels)
+        self.requests = [0] * slots
+        self.request_bytes = [0] * slots
+        self.response_bytes = [0] * slots
+        self.status = [0] * (slots * STATUS_CODE_SLOTS)
+        self.rate = [0] * (slots * RATE_WINDOW)
+        self.rate_seconds = [0] * RATE_WINDOW  # 每个速率槽位当前对应的秒
+        self.lock = threading.Lock()
+    
+    def record(self, endpoint, status, request_bytes, response_bytes):
+        slot = self.index.get(endpoint, self.unmatched)
+        now = int(time.time())
+        second = now % RATE_WINDOW
+        with self.lock:
+            self.requests[slot] += 1
+            self.request_bytes[slot] += request_bytes
+            self.response_bytes[slot] += response_bytes
+            if 0 <= status < STATUS_CODE_SLOTS:
+                self.status[slot * STATUS_CODE_SLOTS + status] += 1
+            if self.rate_seconds[second] != now:
+                # 槽位里是一个窗口之前的数据，先清零
+                self.rate_seconds[second] = now
+                for i in range(second, len(self.rate), RATE_WINDOW):
+                    self.rate[i] = 0
+            self.rate[slot * RATE_WINDOW + second] += 1
+    
+    def snapshot(self):
+        """返回每个路由的(路由, 请求数, 请求字节, 响应字节, {状态码: 次数}, 最近每秒请求数)"""
+        now = int(time.time())
+        seconds = [(t, t % RATE_WINDOW) for t in range(now - RATE_WINDOW + 1, now + 1)]
+        with self.lock:
+            result = []
+            for slot, label in enumerate(self.labels):
+                base = slot * STATUS_CODE_SLOTS
+                codes = {code: count for code, count
+                         in enumerate(self.status[base:base + STATUS_CODE_SLOTS]) if count}
+                base = slot * RATE_WINDOW
+                rate = [self.rate[base + i] if self.rate_seconds[i] == t else 0
+                        for t, i in seconds]
+                result.append((label, self.requests[slot], self.request_bytes[slot],
+                               self.response_bytes[slot], codes, rate))
+            return result
+
+
+class TrafficMiddleware:
+    """WSGI中间件，按实际收发的请求体和响应体字节数记录每个请求"""
+    
+    def __init__(self, wsgi_app, traffic):
+        self.wsgi_app = wsgi_app
+        self.traffic = traffic
+    
+    def __call__(self, environ, start_response):
+        status = [0]
+        
+        def counting_start_response(status_line, headers, exc_info=None):
+            status[0] = int(status_line[:3])
+            return start_response(status_line, headers, exc_info)
+        
+        received = CountingInput(environ['wsgi.input'])
+        environ['wsgi.input'] = received
+        body = self.wsgi_app(environ, counting_start_response)
+        return CountingBody(body, environ, status, received, self.traffic)
+
+
+class CountingInput:
+    """包装wsgi.input，累计应用实际读取的请求体字节数"""
+    
+    def __init__(self, stream):
+        self.stream = stream
+        self.count = 0
+    
+    def read(self, *args):
+        data = self.stream.read(*args)
+        self.count += len(data)
+        return data
+    
+    def readline(self, *args):
+        data = self.stream.readline(*args)
+        self.count += len(data)
+        return data
+    
+    def readlines(self, *args):
+        lines = self.stream.readlines(*args)
+        self.count += sum(len(line) for line in lines)
+        return lines
+    
+    def __iter__(self):
+        for line in self.stream:
+            self.count += len(line)
+            yield line
+
+
+class CountingBody:
+    """包装响应体以累计发送的字节数，WSGI服务器调用close()时记录本次请求"""
+    
+    def __init__(self, body, environ, status, received, traffic):
+        self.body = body
+        self.environ = environ
+        self.status = status
+        self.received = received
+        self.traffic = traffic
+        self.sent = 0
+    
+    def __iter__(self):
+        for chunk in self.body:
+            self.sent += len(chunk)
+            yield chunk
+    
+    def close(self):
+        if hasattr(self.body, 'close'):
+            self.body.close()
+        self.traffic.record(self.environ.get('catbit.endpoint'), self.status[0],
+                            self.received.count, self.sent)
+
 
 # HTML模板
 MAIN_TEMPLATE = '''
@@ -379,10 +995,52 @@ ADMIN_TEMPLATE = '''
             return parseFloat((bytes / Math.pow(k, i)).toFixed(dm)) + ' ' + sizes[i];
         }
         
+        // 还原差分编码：逐项累加
+        function deltaDecode(values) {
+            let total = 0;
+            return values.map(value => total += value);
+        }
+        
+        // 紧凑格式的历史序列还原为 {time, value} 数据点
+        function decodeSeries(series) {
+            const times = deltaDecode(series.t);
+            const values = deltaDecode(series.v);
+            return times.map((time, i) => ({time: time, value: values[i]}));
+        }
+        
+        // 紧凑格式的按列用户数据还原为逐行对象
+        function decodeUsers(columns) {
+            return columns.ip.map((ip, i) => ({
+                ip: ip,
+                location: columns.location[i],
+                user_agent: columns.user_agent[i],
+                timestamp: columns.timestamp[i],
+                requests: columns.requests[i]
+            }));
+        }
+        
+        // 紧凑格式的按列路由流量还原为逐行对象
+        function decodeRoutes(columns) {
+            return columns.route.map((route, i) => ({
+                route: route,
+                requests: columns.requests[i],
+                request_bytes: columns.request_bytes[i],
+                response_bytes: columns.response_bytes[i],
+                status: columns.status[i],
+                rate: columns.rate[i]
+            }));
+        }
+        
         function updateData() {
-            fetch('/admin/api/data')
+            fetch('/admin/api/data?format=compact')
                 .then(response => response.json())
                 .then(data => {
+                    data.connection_history = decodeSeries(data.connection_history);
+                    data.request_history = decodeSeries(data.request_history);
+                    data.data_history = decodeSeries(data.data_history);
+                    data.user_data = decodeUsers(data.user_data);
+                    data.routes = decodeRoutes(data.routes);
+                    
                     // 更新统计数据
                     document.getElementById('active-connections').textContent = data.active_connections;
                     document.getElementById('total-requests').textContent = data.total_requests;
@@ -395,6 +1053,9 @@ ADMIN_TEMPLATE = '''
                     
                     // 更新用户表格
                     updateUsersTable(data.user_data);
+                    
+                    // 更新路由流量
+                    updateRoutes(data.routes);
                 });
         }
         
@@ -438,7 +1099,7 @@ ADMIN_TEMPLATE = '''
             
             const chart = charts[canvasId];
             const labels = data.map(item => new Date(item.time).toLocaleTimeString());
-            const values = data.map(item => item.count || item.bytes);
+            const values = data.map(item => item.value);
             
             chart.data.labels = labels;
             chart.data.datasets[0].data = values;
@@ -459,6 +1120,53 @@ ADMIN_TEMPLATE = '''
             });
         }
         
+        function updateRoutes(routes) {
+            const tbody = document.querySelector('#routes-table tbody');
+            tbody.innerHTML = '';
+            
+            routes.forEach(route => {
+                const row = tbody.insertRow();
+                const recent = route.rate.reduce((sum, count) => sum + count, 0);
+                row.insertCell().textContent = route.route;
+                row.insertCell().textContent = route.requests;
+                row.insertCell().textContent = formatBytes(route.request_bytes);
+                row.insertCell().textContent = formatBytes(route.response_bytes);
+                row.insertCell().textContent = Object.entries(route.status)
+                    .map(([code, count]) => code + ': ' + count).join(', ');
+                row.insertCell().textContent = (recent / route.rate.length).toFixed(2) + '/s';
+            });
+            
+            // 只画最近有流量的路由的每秒请求数
+            const active = routes.filter(route => route.rate.some(count => count > 0));
+            if (!charts['routes-chart']) {
+                const ctx = document.getElementById('routes-chart').getContext('2d');
+                charts['routes-chart'] = new Chart(ctx, {
+                    type: 'line',
+                    data: {labels: [], datasets: []},
+                    options: {
+                        responsive: true,
+                        animation: false,
+                        scales: {
+                            x: {display: true, title: {display: true, text: '秒前'}},
+                            y: {display: true, title: {display: true, text: '每秒请求数'}}
+                        }
+                    }
+                });
+            }
+            
+            const chart = charts['routes-chart'];
+            const length = routes.length ? routes[0].rate.length : 0;
+            chart.data.labels = Array.from({length: length}, (_, i) => length - 1 - i);
+            chart.data.datasets = active.map((route, i) => ({
+                label: route.route,
+                data: route.rate,
+                borderColor: 'hsl(' + (i * 67 % 360) + ', 60%, 50%)',
+                fill: false,
+                tension: 0.2
+            }));
+            chart.update();
+        }
+        
         function exportToCSV() {
             window.location.href = '/admin/export';
         }
@@ -502,6 +1210,24 @@ ADMIN_TEMPLATE = '''
             </div>
         </div>
         
+        <div class="users-table" style="margin-bottom: 20px;">
+            <h3>路由流量统计</h3>
+            <canvas id="routes-chart"></canvas>
+            <table id="routes-table">
+                <thead>
+                    <tr>
+                        <th>路由</th>
+                        <th>请求次数</th>
+                        <th>请求数据量</th>
+                        <th>响应数据量</th>
+                        <th>状态码</th>
+                        <th>最近60秒速率</th>
+                    </tr>
+                </thead>
+                <tbody></tbody>
+            </table>
+        </div>
+        
         <div class="users-table">
             <h3>用户访问记录</h3>
             <table id="users-table">
@@ -587,159 +1313,298 @@ LOGIN_TEMPLATE = '''
 </html>
 '''
 
-@app.route('/')
-def index():
-    ip = request.remote_addr
-    user_agent = request.headers.get('User-Agent')
-    current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    
-    # 记录连接
-    stats.add_connection(ip, user_agent)
-    
-    return render_template_string(MAIN_TEMPLATE, 
-                                 ip=ip, 
-                                 user_agent=user_agent, 
-                                 current_time=current_time,
-                                 location="正在获取...")
-
-@app.route('/update_location', methods=['POST'])
-def update_location():
-    data = request.json
-    ip = request.remote_addr
-    location = f"纬度: {data.get('latitude', '未知')}, 经度: {data.get('longitude', '未知')}"
-    
-    # 更新用户位置信息
-    with stats.lock:
-        for user in stats.user_data:
-            if user['ip'] == ip:
-                user['location'] = location
-                break
-    
-    return jsonify({'status': 'success'})
-
-@app.route('/send_data', methods=['POST'])
-def send_data():
-    ip = request.remote_addr
-    stats.add_data_transfer(ip, 1024 * 1024)  # 1MB
-    return jsonify({'status': 'success', 'message': '已发送1MB数据'})
-
-@app.route('/admin', methods=['GET', 'POST'])
-def admin_login():
-    if request.method == 'POST':
-        password = request.form.get('password')
-        if password == '123456':
-            session['admin'] = True
+def create_app(config=None):
+    """创建应用，日志、集群同步等子系统只在启用时才按需初始化"""
+    app = Flask(__name__)
+    app.config.update(DEFAULT_CONFIG)
+    app.config.update(config or {})
+    app.secret_key = app.config['SECRET_KEY'] or secrets.token_hex(16)
+    
+    stats = Statistics(log_enabled=app.config['LOG_ENABLED'])
+    cluster = {'aggregator': None, 'started': False}
+    cluster_lock = threading.Lock()
+    
+    def start_cluster():
+        # 首个请求到来（或命令行启动）时才创建聚合器和推送线程
+        if cluster['started']:
+            return
+        with cluster_lock:
+            if cluster['started']:
+                return
+            token = app.config['CLUSTER_TOKEN']
+            interval = app.config['SYNC_INTERVAL']
+            if app.config['AGGREGATE']:
+                cluster['aggregator'] = Aggregator(stats, app.config['PEERS'], token, interval)
+                cluster['aggregator'].start()
+            if app.config['PUSH_TO']:
+                push_snapshots(stats, app.config['PUSH_TO'], token, interval,
+                               app.config['NODE_NAME'])
+            cluster['started'] = True
+    
+    app.extensions['catbit'] = {'stats': stats, 'start_cluster': start_cluster}
+    
+    @app.route('/')
+    def index():
+        ip = request.remote_addr
+        user_agent = request.headers.get('User-Agent')
+        current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        
+        # 记录连接
+        stats.add_connection(ip, user_agent)
+        
+        return render_template_string(MAIN_TEMPLATE, 
+                                     ip=ip, 
+                                     user_agent=user_agent, 
+                                     current_time=current_time,
+                                     location="正在获取...")
+
+    @app.route('/update_location', methods=['POST'])
+    def update_location():
+        data = request.json
+        ip = request.remote_addr
+        location = f"纬度: {data.get('latitude', '未知')}, 经度: {data.get('longitude', '未知')}"
+        
+        # 更新用户位置信息
+        stats.update_location(ip, location)
+        
+        return jsonify({'status': 'success'})
+
+    @app.route('/send_data', methods=['POST'])
+    def send_data():
+        ip = request.remote_addr
+        stats.add_data_transfer(ip, 1024 * 1024)  # 1MB
+        return jsonify({'status': 'success', 'message': '已发送1MB数据'})
+
+    @app.route('/admin', methods=['GET', 'POST'])
+    def admin_login():
+        if request.method == 'POST':
+            password = request.form.get('password')
+            if password == app.config['ADMIN_PASSWORD']:
+                session['admin'] = True
+                return admin_panel()
+            return render_template_string(LOGIN_TEMPLATE, error="密码错误")
+        
+        if session.get('admin'):
             return admin_panel()
-        return render_template_string(LOGIN_TEMPLATE, error="密码错误")
-    
-    if session.get('admin'):
-        return admin_panel()
-    
-    return render_template_string(LOGIN_TEMPLATE)
-
-@app.route('/admin/panel')
-def admin_panel():
-    if not session.get('admin'):
-        return admin_login()
-    return render_template_string(ADMIN_TEMPLATE)
-
-@app.route('/admin/api/data')
-def admin_data():
-    if not session.get('admin'):
-        return jsonify({'error': '未授权'}), 401
-    
-    with stats.lock:
-        # 准备最近30个数据点用于图表
-        connection_data = stats.connection_history[-30:] if stats.connection_history else []
-        request_data = stats.request_history[-30:] if stats.request_history else []
-        data_history = stats.data_history[-30:] if stats.data_history else []
-        
-        return jsonify({
-            'active_connections': stats.active_connections,
-            'total_requests': stats.total_requests,
-            'total_data_transferred': stats.total_data_transferred,
-            'connection_history': [{'time': item['time'].isoformat(), 'count': item['count']} 
-                                 for item in connection_data],
-            'request_history': [{'time': item['time'].isoformat(), 'count': item['count']} 
-                              for item in request_data],
-            'data_history': [{'time': item['time'].isoformat(), 'bytes': item['bytes']} 
-                           for item in data_history],
-            'user_data': [{
-                'ip': user['ip'],
-                'location': user['location'],
-                'user_agent': user['user_agent'],
-                'timestamp': user['timestamp'].isoformat(),
-                'requests': user['requests']
-            } for user in stats.user_data[-50:]]  # 只返回最近50个用户
-        })
-
-@app.route('/admin/export')
-def export_data():
-    if not session.get('admin'):
-        return jsonify({'error': '未授权'}), 401
-    
-    # 创建CSV文件
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(['IP地址', '位置', 'User Agent', '最后访问时间', '请求次数'])
-    
-    with stats.lock:
-        for user in stats.user_data:
-            writer.writerow([
-                user['ip'],
-                user['location'],
-                user['user_agent'],
-                user['timestamp'].strftime("%Y-%m-%d %H:%M:%S"),
-                user['requests']
-            ])
-    
-    output.seek(0)
-    return send_file(
-        io.BytesIO(output.getvalue().encode('utf-8')),
-        mimetype='text/csv',
-        as_attachment=True,
-        download_name=f'user_data_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
-    )
+        
+        return render_template_string(LOGIN_TEMPLATE)
+
+    @app.route('/admin/panel')
+    def admin_panel():
+        if not session.get('admin'):
+            return admin_login()
+        return render_template_string(ADMIN_TEMPLATE)
+
+    @app.route('/admin/api/data')
+    def admin_data():
+        if not session.get('admin'):
+            return jsonify({'error': '未授权'}), 401
+        
+        points = min(max(request.args.get('points', 30, type=int), 1), MAX_HISTORY_POINTS)
+        compact = request.args.get('format') == 'compact'
+        
+        # 聚合模式下返回所有节点合并后的数据
+        aggregator = cluster['aggregator']
+        if aggregator is not None:
+            data = aggregator.admin_data(points)
+        else:
+            with stats.lock:
+                # 准备最近的数据点用于图表
+                data = {
+                    'active_connections': stats.active_connections,
+                    'total_requests': stats.total_requests,
+                    'total_data_transferred': stats.total_data_transferred,
+                    'connection_history': [(item['time'], item['count'])
+                                           for item in stats.connection_history[-points:]],
+                    'request_history': [(item['time'], item['count'])
+                                        for item in stats.request_history[-points:]],
+                    'data_history': [(item['time'], item['bytes'])
+                                     for item in stats.data_history[-points:]],
+                    'user_data': [(user['ip'], user['location'], user['user_agent'],
+                                   user['timestamp'], user['requests'])
+                                  for user in stats.user_data[-50:]]  # 只返回最近50个用户
+                }
+        # 路由流量只统计本节点
+        data['routes'] = traffic.snapshot() if traffic is not None else []
+        
+        if compact:
+            body = json.dumps(encode_admin_data(data, compact=True),
+                              ensure_ascii=False, separators=(',', ':'))
+            response = Response(body, mimetype='application/json')
+        else:
+            response = jsonify(encode_admin_data(data))
+        return compress_response(response)
+    
+    @app.route('/admin/export')
+    def export_data():
+        if not session.get('admin'):
+            return jsonify({'error': '未授权'}), 401
+        
+        # 创建CSV文件
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerow(['IP地址', '位置', 'User Agent', '最后访问时间', '请求次数'])
+        
+        with stats.lock:
+            for user in stats.user_data:
+                writer.writerow([
+                    user['ip'],
+                    user['location'],
+                    user['user_agent'],
+                    user['timestamp'].strftime("%Y-%m-%d %H:%M:%S"),
+                    user['requests']
+                ])
+        
+        response = Response(output.getvalue().encode('utf-8'), mimetype='text/csv')
+        response.headers.set('Content-Disposition', 'attachment',
+                             filename=f'user_data_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv')
+        return compress_response(response)
+    
+    def cluster_authorized():
+        token = app.config['CLUSTER_TOKEN']
+        # compare_digest只接受ASCII字符串，改为比较字节：WSGI按latin-1解码请求头，
+        # 还原成原始字节后与UTF-8编码的密钥比较
+        header = request.headers.get('X-Cluster-Token', '').encode('latin-1', 'replace')
+        return token is not None and secrets.compare_digest(header, token.encode('utf-8'))
+
+    @app.route('/cluster/snapshot')
+    def cluster_snapshot():
+        if not cluster_authorized():
+            return jsonify({'error': '未授权'}), 401
+        since = request.args.get('since', 0, type=int)
+        return jsonify(stats.export_snapshot(since))
+
+    @app.route('/cluster/push', methods=['POST'])
+    def cluster_push():
+        if not cluster_authorized():
+            return jsonify({'error': '未授权'}), 401
+        aggregator = cluster['aggregator']
+        if aggregator is None:
+            return jsonify({'error': '当前节点未开启聚合模式'}), 400
+        
+        snapshot = request.get_json(silent=True)
+        try:
+            validate_snapshot(snapshot)
+        except ValueError as e:
+            return jsonify({'error': f'快照格式错误: {e}'}), 400
+        if not aggregator.apply_snapshot(snapshot, source=snapshot.get('source')):
+            # 增量不连续，告知推送方从已确认的版本重新推送
+            return jsonify({'version': aggregator.known_version(snapshot['node'])}), 409
+        return jsonify({'version': snapshot['version']})
+
+    @app.route('/admin/logout')
+    def logout():
+        session.pop('admin', None)
+        return '<script>alert("已退出登录"); window.location.href="/admin";</script>'
+
+    @app.before_request
+    def before_request():
+        # 供TrafficMiddleware按路由归类本次请求
+        request.environ['catbit.endpoint'] = request.endpoint
+        start_cluster()
+        
+        # 记录每个请求的时间戳（集群内部同步请求不计入）
+        if request.remote_addr and not request.path.startswith('/cluster/'):
+            stats.connection_timestamps[request.remote_addr].append(time.time())
 
-@app.route('/admin/logout')
-def logout():
-    session.pop('admin', None)
-    return '<script>alert("已退出登录"); window.location.href="/admin";</script>'
-
-@app.before_request
-def before_request():
-    # 记录每个请求的时间戳
-    if request.remote_addr:
-        stats.connection_timestamps[request.remote_addr].append(time.time())
-
-@app.after_request
-def after_request(response):
-    # 清理超过30秒不活跃的连接
-    current_time = time.time()
-    with stats.lock:
-        for ip in list(stats.connection_timestamps.keys()):
-            # 保留最近30秒内的连接
-            stats.connection_timestamps[ip] = [
-                ts for ts in stats.connection_timestamps[ip] 
-                if current_time - ts < 30
-            ]
-            # 如果最近30秒内没有连接，则移除
-            if not stats.connection_timestamps[ip]:
-                del stats.connection_timestamps[ip]
-        
-        # 更新活跃连接数
-        stats.active_connections = len(stats.connection_timestamps)
+    @app.after_request
+    def after_request(response):
+        # 清理超过30秒不活跃的连接
+        current_time = time.time()
+        with stats.lock:
+            for ip in list(stats.connection_timestamps.keys()):
+                # 保留最近30秒内的连接
+                stats.connection_timestamps[ip] = [
+                    ts for ts in stats.connection_timestamps[ip] 
+                    if current_time - ts < 30
+                ]
+                # 如果最近30秒内没有连接，则移除
+                if not stats.connection_timestamps[ip]:
+                    del stats.connection_timestamps[ip]
+            
+            # 更新活跃连接数
+            stats.active_connections = len(stats.connection_timestamps)
+        
+        return response
     
-    return response
+    # 路由注册完毕后再分配流量计数器
+    traffic = None
+    if app.config['TRAFFIC_ENABLED']:
+        routes = {}
+        for rule in app.url_map.iter_rules():
+            routes.setdefault(rule.endpoint, rule.rule)
+        traffic = RouteTraffic(sorted(routes.items(), key=lambda item: item[1]))
+        app.wsgi_app = TrafficMiddleware(app.wsgi_app, traffic)
+    app.extensions['catbit']['traffic'] = traffic
+    
+    return app
+
+
+def measure_startup(runs=5):
+    """在全新的解释器中测量导入模块并创建应用的耗时（毫秒），取中位数"""
+    import subprocess
+    code = (
+        "import time, importlib.util\n"
+        "start = time.perf_counter()\n"
+        f"spec = importlib.util.spec_from_file_location('catbit', {os.path.abspath(__file__)!r})\n"
+        "module = importlib.util.module_from_spec(spec)\n"
+        "spec.loader.exec_module(module)\n"
+        "module.create_app({'LOG_ENABLED': False})\n"
+        "print((time.perf_counter() - start) * 1000)\n"
+    )
+    results = sorted(
+        float(subprocess.run([sys.executable, '-c', code], capture_output=True,
+                             text=True, check=True).stdout)
+        for _ in range(runs)
+    )
+    return results[len(results) // 2]
 
 if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='系统监控服务')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=2250)
+    parser.add_argument('--quiet', action='store_true', help='不在控制台输出访问日志')
+    parser.add_argument('--no-traffic', action='store_true', help='不按路由统计流量')
+    parser.add_argument('--cluster-token', help='集群接口共享密钥，不设置则关闭集群接口')
+    parser.add_argument('--aggregate', action='store_true', help='以聚合模式运行，合并其他节点的统计数据')
+    parser.add_argument('--peer', action='append', default=[], help='聚合模式下定期拉取的节点地址，可重复指定')
+    parser.add_argument('--push-to', help='定期把本节点的增量快照推送到该聚合节点')
+    parser.add_argument('--node-name', help='推送快照时使用的节点名称，默认为"主机名:端口"，各节点必须不同')
+    parser.add_argument('--sync-interval', type=float, default=5, help='集群同步间隔（秒）')
+    parser.add_argument('--check-startup', type=float, nargs='?', const=STARTUP_BUDGET_MS,
+                        metavar='BUDGET_MS', help='测量导入和创建应用的耗时，超出预算时以非零状态退出')
+    args = parser.parse_args()
+    
+    if args.check_startup is not None:
+        elapsed = measure_startup()
+        ok = elapsed <= args.check_startup
+        print(f"启动耗时 {elapsed:.1f}ms，预算 {args.check_startup:.0f}ms，{'通过' if ok else '超出预算'}")
+        sys.exit(0 if ok else 1)
+    
+    app = create_app({
+        'LOG_ENABLED': not args.quiet,
+        'TRAFFIC_ENABLED': not args.no_traffic,
+        'CLUSTER_TOKEN': args.cluster_token,
+        'AGGREGATE': args.aggregate,
+        'PEERS': args.peer,
+        'PUSH_TO': args.push_to,
+        'SYNC_INTERVAL': args.sync_interval,
+        'NODE_NAME': args.node_name or default_node_name(args.port),
+    })
+    app.extensions['catbit']['start_cluster']()
+    
+    Fore, Style = colors()
+    address = f"{args.host}:{args.port}"
     print(Fore.CYAN + "="*60)
     print(Fore.YELLOW + "系统启动中...")
-    print(Fore.GREEN + f"服务器将在 127.0.0.1:2250 上运行")
-    print(Fore.CYAN + f"访问地址: http://127.0.0.1:2250")
-    print(Fore.CYAN + f"管理面板: http://127.0.0.1:2250/admin")
-    print(Fore.YELLOW + "管理员密码: 123456")
+    print(Fore.GREEN + f"服务器将在 {address} 上运行")
+    print(Fore.CYAN + f"访问地址: http://{address}")
+    print(Fore.CYAN + f"管理面板: http://{address}/admin")
+    print(Fore.YELLOW + f"管理员密码: {app.config['ADMIN_PASSWORD']}")
+    if args.aggregate:
+        print(Fore.GREEN + f"聚合模式: 拉取 {len(args.peer)} 个节点")
     print(Fore.CYAN + "="*60)
     print(Style.RESET_ALL)
     
-    app.run(host='127.0.0.1', port=2250, debug=False)
+    app.run(host=args.host, port=args.port, debug=False)
@@ -0,0 +1,34 @@
+import importlib.util
+import os
+
+import pytest
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '1.0.py')
+
+
+@pytest.fixture(scope='session')
+def catbit():
+    """以模块方式加载1.0.py（文件名不是合法的模块名，无法直接import）"""
+    pytest.importorskip('flask')
+    pytest.importorskip('colorama')
+    spec = importlib.util.spec_from_file_location('catbit', APP)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def make_app(catbit):
+    def make(**config):
+        return catbit.create_app(dict({'LOG_ENABLED': False}, **config))
+    return make
+
+
+@pytest.fixture
+def admin_client():
+    def login(app):
+        client = app.test_client()
+        with client.post('/admin', data={'password': app.config['ADMIN_PASSWORD']}):
+            pass
+        return client
+    return login
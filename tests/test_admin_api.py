@@ -0,0 +1,127 @@
+"""管理接口编码和压缩的测试"""
+import gzip
+import itertools
+import json
+from datetime import datetime
+
+import pytest
+
+
+def populated_app(make_app, **config):
+    app = make_app(**config)
+    client = app.test_client()
+    for i in range(12):
+        with client.get('/', headers={'User-Agent': 'ua-%d' % i},
+                        environ_base={'REMOTE_ADDR': '10.0.0.%d' % (i % 5)}):
+            pass
+        with client.post('/send_data'):
+            pass
+    return app
+
+
+def get_data(client, query='', **headers):
+    with client.get('/admin/api/data' + query, headers=headers) as resp:
+        return resp.status_code, dict(resp.headers), resp.get_data()
+
+
+def millis(iso):
+    return int(datetime.fromisoformat(iso).timestamp() * 1000)
+
+
+def test_compact_round_trip_matches_verbose(make_app, admin_client):
+    client = admin_client(populated_app(make_app))
+    _, _, verbose = get_data(client, '?points=100')
+    _, _, compact = get_data(client, '?points=100&format=compact')
+    verbose = json.loads(verbose)
+    compact = json.loads(compact)
+
+    assert compact['format'] == 'compact'
+    for key, field in (('connection_history', 'count'), ('request_history', 'count'),
+                       ('data_history', 'bytes')):
+        # 与面板脚本的deltaDecode相同：逐项累加还原
+        times = list(itertools.accumulate(compact[key]['t']))
+        values = list(itertools.accumulate(compact[key]['v']))
+        assert values == [point[field] for point in verbose[key]]
+        assert times == [millis(point['time']) for point in verbose[key]]
+
+    users = compact['user_data']
+    assert users['ip'] == [u['ip'] for u in verbose['user_data']]
+    assert users['requests'] == [u['requests'] for u in verbose['user_data']]
+    assert users['timestamp'] == [millis(u['timestamp']) for u in verbose['user_data']]
+    assert compact['routes']['route'] == [r['route'] for r in verbose['routes']]
+    for key in ('total_requests', 'total_data_transferred'):
+        assert compact[key] == verbose[key]
+
+
+def test_verbose_format_keeps_original_shape(make_app, admin_client):
+    app = populated_app(make_app)
+    _, _, body = get_data(admin_client(app))
+    data = json.loads(body)
+    stats = app.extensions['catbit']['stats']
+
+    assert data['total_requests'] == 12
+    assert data['total_data_transferred'] == 12 * 1024 * 1024
+    assert len(data['request_history']) == 12
+    assert set(data['connection_history'][0]) == {'time', 'count'}
+    assert set(data['request_history'][0]) == {'time', 'count'}
+    assert set(data['data_history'][-1]) == {'time', 'bytes'}
+    # ISO时间与原始datetime完全一致（保留微秒）
+    assert data['request_history'][-1]['time'] == stats.request_history[-1]['time'].isoformat()
+    assert set(data['user_data'][0]) == {'ip', 'location', 'user_agent', 'timestamp', 'requests'}
+    assert data['user_data'][0]['timestamp'] == stats.user_data[0]['timestamp'].isoformat()
+
+
+def test_gzip_is_negotiated(make_app, admin_client):
+    client = admin_client(populated_app(make_app))
+    _, _, plain = get_data(client)
+    status, headers, body = get_data(client, **{'Accept-Encoding': 'gzip'})
+
+    assert status == 200
+    assert headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in headers['Vary']
+    assert len(body) < len(plain)
+    assert json.loads(gzip.decompress(body))['total_requests'] == 12
+
+
+def test_export_is_compressed(make_app, admin_client):
+    app = make_app()
+    client = app.test_client()
+    for i in range(20):
+        with client.get('/', environ_base={'REMOTE_ADDR': '10.0.1.%d' % i}):
+            pass
+    client = admin_client(app)
+    with client.get('/admin/export', headers={'Accept-Encoding': 'gzip'}) as resp:
+        assert resp.headers['Content-Encoding'] == 'gzip'
+        assert 'attachment' in resp.headers['Content-Disposition']
+        assert gzip.decompress(resp.get_data()).decode('utf-8').startswith('IP地址')
+
+
+def test_small_and_identity_responses_are_not_compressed(catbit, make_app, admin_client):
+    client = admin_client(make_app(TRAFFIC_ENABLED=False))
+    _, headers, body = get_data(client, '?format=compact', **{'Accept-Encoding': 'gzip'})
+    assert len(body) < catbit.COMPRESS_MIN_SIZE
+    assert 'Content-Encoding' not in headers
+    assert 'Accept-Encoding' in headers['Vary']
+
+    client = admin_client(populated_app(make_app))
+    _, headers, body = get_data(client, **{'Accept-Encoding': 'identity'})
+    assert len(body) >= catbit.COMPRESS_MIN_SIZE
+    assert 'Content-Encoding' not in headers
+    json.loads(body)
+
+
+def test_brotli_is_not_offered_when_missing(catbit, make_app, admin_client):
+    if catbit.brotli_module() is not None:
+        pytest.skip('已安装brotli')
+    client = admin_client(populated_app(make_app))
+    _, headers, _ = get_data(client, **{'Accept-Encoding': 'br'})
+    assert 'Content-Encoding' not in headers
+
+
+def test_points_are_clamped(catbit, make_app, admin_client, monkeypatch):
+    monkeypatch.setattr(catbit, 'MAX_HISTORY_POINTS', 5)
+    client = admin_client(populated_app(make_app))
+    for query, expected in (('?points=100000', 5), ('?points=3', 3), ('?points=0', 1),
+                            ('?points=-4', 1), ('', 5)):
+        _, _, body = get_data(client, query)
+        assert len(json.loads(body)['request_history']) == expected, query
@@ -0,0 +1,84 @@
+"""Aggregator增量合并的进程内测试"""
+import socket
+
+
+def make_node(catbit, active):
+    stats = catbit.Statistics(log_enabled=False)
+    stats.add_connection('10.0.0.%d' % active, 'ua')
+    stats.active_connections = active
+    return stats
+
+
+def test_pushers_sharing_host_and_port_keep_their_connections(catbit, monkeypatch):
+    # 负载均衡后的两台机器都监听0.0.0.0:2250，默认节点名称仍应不同
+    names = []
+    for host in ('web-a', 'web-b'):
+        monkeypatch.setattr(socket, 'gethostname', lambda host=host: host)
+        names.append(catbit.default_node_name(2250))
+    assert names[0] != names[1]
+
+    aggregator = catbit.Aggregator(catbit.Statistics(log_enabled=False))
+    nodes = [make_node(catbit, 4), make_node(catbit, 3)]
+    versions = [0, 0]
+    for _ in range(3):
+        for i, (stats, name) in enumerate(zip(nodes, names)):
+            snapshot = stats.export_snapshot(versions[i])
+            assert aggregator.apply_snapshot(snapshot, source=name)
+            versions[i] = snapshot['version']
+        assert aggregator.counters[2] == 7
+
+
+def test_new_node_id_from_same_source_retires_previous_node(catbit):
+    aggregator = catbit.Aggregator(catbit.Statistics(log_enabled=False))
+    aggregator.apply_snapshot(make_node(catbit, 4).export_snapshot(), source='web-a:2250')
+    aggregator.apply_snapshot(make_node(catbit, 1).export_snapshot(), source='web-a:2250')
+    assert aggregator.counters[2] == 1
+    assert aggregator.counters[0] == 2
+
+
+def push(client, snapshot, token='t'):
+    with client.post('/cluster/push', json=snapshot, headers={'X-Cluster-Token': token}) as resp:
+        return resp.status_code, resp.get_json()
+
+
+def test_invalid_push_is_rejected_without_changing_state(make_app, admin_client):
+    app = make_app(AGGREGATE=True, CLUSTER_TOKEN='t')
+    client = app.test_client()
+    snapshot = {'node': 'n1', 'since': 0, 'version': 1, 'counters': [2, 0, 1],
+                'users': [['10.0.0.1', 'ua', '未知', 1700000000.0, 2]],
+                'buckets': [[1700000000 // 60 * 60, 2, 0, 1]]}
+    assert push(client, snapshot) == (200, {'version': 1})
+
+    invalid = [
+        dict(snapshot, since=1, version=2, counters=[5, 0, 1], users=[['10.0.0.2']]),
+        dict(snapshot, since=1, version=2, counters=[5, 0, 1], buckets=[[1, 2]]),
+        {key: value for key, value in snapshot.items() if key != 'since'},
+        dict(snapshot, counters=[1, 2]),
+        dict(snapshot, version='2'),
+        None,
+    ]
+    for body in invalid:
+        status, _ = push(client, body)
+        assert status == 400
+
+    with client.post('/cluster/push', data='not json', content_type='application/json',
+                     headers={'X-Cluster-Token': 't'}) as resp:
+        assert resp.status_code == 400
+
+    with admin_client(app).get('/admin/api/data') as resp:
+        data = resp.get_json()
+    assert data['total_requests'] == 2
+    assert [u['requests'] for u in data['user_data']] == [2]
+
+
+def test_cluster_token_comparison_handles_non_ascii(make_app):
+    app = make_app(CLUSTER_TOKEN='密钥')
+    client = app.test_client()
+    # 未编码的非ASCII请求头不能导致500
+    with client.get('/cluster/snapshot', headers={'X-Cluster-Token': 'é'}) as resp:
+        assert resp.status_code == 401
+    for token, status in (('错误', 401), ('', 401), ('密钥', 200)):
+        # 客户端按UTF-8字节发送请求头，WSGI再按latin-1解码
+        header = token.encode('utf-8').decode('latin-1')
+        with client.get('/cluster/snapshot', headers={'X-Cluster-Token': header}) as resp:
+            assert resp.status_code == status
@@ -0,0 +1,56 @@
+"""create_app工厂的测试"""
+import subprocess
+import sys
+
+
+def test_startup_within_budget(catbit):
+    elapsed = catbit.measure_startup()
+    assert elapsed <= catbit.STARTUP_BUDGET_MS, f'启动耗时 {elapsed:.1f}ms'
+
+
+def test_import_does_not_initialise_optional_subsystems(catbit):
+    # 在全新的解释器中导入，导入本身不应创建应用，也不加载只在启用时才需要的依赖
+    code = (
+        "import importlib.util, sys\n"
+        f"spec = importlib.util.spec_from_file_location('catbit', {catbit.__file__!r})\n"
+        "module = importlib.util.module_from_spec(spec)\n"
+        "spec.loader.exec_module(module)\n"
+        "print(hasattr(module, 'app'), hasattr(module, 'stats'),\n"
+        "      [name for name in ('colorama', 'brotli', 'gzip', 'urllib.request', 'argparse')\n"
+        "       if name in sys.modules])\n"
+    )
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True,
+                            text=True, check=True).stdout
+    assert output.strip() == 'False False []'
+
+
+def test_apps_do_not_share_state(make_app):
+    first = make_app(AGGREGATE=True, CLUSTER_TOKEN='t')
+    second = make_app()
+    first_ext = first.extensions['catbit']
+    second_ext = second.extensions['catbit']
+    assert first_ext['stats'] is not second_ext['stats']
+    assert first_ext['traffic'] is not second_ext['traffic']
+    assert first.secret_key != second.secret_key
+
+    with first.test_client().get('/') as resp:
+        assert resp.status_code == 200
+    assert first_ext['stats'].total_requests == 1
+    assert second_ext['stats'].total_requests == 0
+    assert second_ext['traffic'].snapshot()[0][1] == 0
+
+    # 聚合模式只在第一个应用上启用
+    with second.test_client().post('/cluster/push', json={},
+                                   headers={'X-Cluster-Token': 't'}) as resp:
+        assert resp.status_code == 401
+    with first.test_client().post('/cluster/push', json={},
+                                  headers={'X-Cluster-Token': 't'}) as resp:
+        assert resp.status_code == 400
+
+
+def test_config_overrides_defaults(make_app, admin_client):
+    app = make_app(ADMIN_PASSWORD='secret')
+    assert app.config['ADMIN_PASSWORD'] == 'secret'
+    assert app.config['SYNC_INTERVAL'] == 5
+    with admin_client(app).get('/admin/api/data') as resp:
+        assert resp.status_code == 200
@@ -0,0 +1,170 @@
+"""多节点聚合的端到端测试：在不同端口上启动独立进程，检查合并结果"""
+import http.cookiejar
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+pytest.importorskip('flask')
+pytest.importorskip('colorama')
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '1.0.py')
+TOKEN = 'test-token'
+INTERVAL = 0.2
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_until(check, timeout=10):
+    deadline = time.time() + timeout
+    while True:
+        try:
+            if check():
+                return
+        except (OSError, ValueError):
+            pass
+        if time.time() > deadline:
+            raise AssertionError('等待超时')
+        time.sleep(0.1)
+
+
+class Node:
+    def __init__(self, *args, port=None):
+        self.port = port or free_port()
+        self.url = f'http://127.0.0.1:{self.port}'
+        self.process = subprocess.Popen(
+            [sys.executable, APP, '--quiet', '--port', str(self.port),
+             '--cluster-token', TOKEN, '--sync-interval', str(INTERVAL), *args],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        # 只探测端口是否可连接，避免探测请求被计为活跃连接
+        wait_until(lambda: socket.create_connection(('127.0.0.1', self.port), timeout=1).close() is None)
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    def visit(self, times=1):
+        for _ in range(times):
+            self.opener.open(self.url + '/', timeout=5).read()
+
+    def send_data(self):
+        req = urllib.request.Request(self.url + '/send_data', data=b'{}',
+                                     headers={'Content-Type': 'application/json'})
+        self.opener.open(req, timeout=5).read()
+
+    def admin_data(self):
+        self.opener.open(self.url + '/admin', data=b'password=123456', timeout=5).read()
+        return json.loads(self.opener.open(self.url + '/admin/api/data', timeout=5).read())
+
+    def stop(self):
+        self.process.terminate()
+        self.process.wait(timeout=10)
+
+
+@pytest.fixture
+def nodes():
+    started = []
+
+    def start(*args, port=None):
+        node = Node(*args, port=port)
+        started.append(node)
+        return node
+
+    yield start
+    for node in started:
+        node.stop()
+
+
+def push(aggregator, snapshot):
+    req = urllib.request.Request(aggregator.url + '/cluster/push',
+                                 data=json.dumps(snapshot).encode('utf-8'),
+                                 headers={'Content-Type': 'application/json',
+                                          'X-Cluster-Token': TOKEN})
+    try:
+        with urllib.request.urlopen(req, timeout=5) as resp:
+            return resp.status, json.loads(resp.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def test_merges_pulled_and_pushed_nodes(nodes):
+    pulled = nodes()
+    aggregator = nodes('--aggregate', '--peer', pulled.url)
+    pushed = nodes('--push-to', aggregator.url)
+
+    pulled.visit(3)
+    pushed.visit(2)
+    pushed.send_data()
+
+    wait_until(lambda: aggregator.admin_data()['total_requests'] == 5)
+    data = aggregator.admin_data()
+    assert data['nodes'] == 3
+    assert data['total_data_transferred'] == 1024 * 1024
+    # 查询聚合节点本身也算一个活跃连接
+    wait_until(lambda: aggregator.admin_data()['active_connections'] == 3)
+
+    # 后续只传增量，合并结果继续累加
+    pulled.visit(1)
+    wait_until(lambda: aggregator.admin_data()['total_requests'] == 6)
+
+
+def test_restarted_nodes_are_resynced_and_retired(nodes):
+    pulled = nodes()
+    aggregator = nodes('--aggregate', '--peer', pulled.url)
+    pushed = nodes('--push-to', aggregator.url)
+    pulled.visit(2)
+    pushed.visit(1)
+    wait_until(lambda: aggregator.admin_data()['active_connections'] == 3)
+
+    # 两个节点重启后节点ID改变，应重新全量同步，旧节点的活跃连接不再计入
+    port = pulled.port
+    pulled.stop()
+    pulled = nodes(port=port)
+    port = pushed.port
+    pushed.stop()
+    pushed = nodes('--push-to', aggregator.url, port=port)
+    pulled.visit(1)
+
+    wait_until(lambda: aggregator.admin_data()['total_requests'] == 4)
+    wait_until(lambda: aggregator.admin_data()['active_connections'] == 2)
+    assert aggregator.admin_data()['nodes'] == 5
+
+
+def test_stale_nodes_are_retired(nodes):
+    aggregator = nodes('--aggregate')
+    pushed = nodes('--push-to', aggregator.url)
+    pushed.visit(1)
+    wait_until(lambda: aggregator.admin_data()['active_connections'] == 2)
+
+    pushed.stop()
+    wait_until(lambda: aggregator.admin_data()['active_connections'] == 1)
+    assert aggregator.admin_data()['total_requests'] == 1
+
+
+def test_push_with_version_gap_is_rejected(nodes):
+    aggregator = nodes('--aggregate')
+    snapshot = {'node': 'n1', 'since': 0, 'version': 2, 'counters': [2, 0, 1],
+                'users': [['10.0.0.1', 'ua', '未知', time.time(), 2]], 'buckets': []}
+
+    # 未知节点只接受全量快照，409时返回已确认的版本
+    status, body = push(aggregator, dict(snapshot, since=1))
+    assert (status, body) == (409, {'version': 0})
+    assert push(aggregator, snapshot) == (200, {'version': 2})
+
+    gap = dict(snapshot, since=5, version=7, counters=[7, 0, 1])
+    assert push(aggregator, gap) == (409, {'version': 2})
+    delta = dict(snapshot, since=2, version=3, counters=[3, 0, 1],
+                 users=[['10.0.0.1', 'ua', '未知', time.time(), 3]])
+    assert push(aggregator, delta) == (200, {'version': 3})
+
+    data = aggregator.admin_data()
+    assert data['total_requests'] == 3
+    assert [u['requests'] for u in data['user_data'] if u['ip'] == '10.0.0.1'] == [3]
@@ -0,0 +1,105 @@
+"""路由流量统计的测试；请求在响应关闭时才记录，所以每个请求都用with关闭响应"""
+import io
+import json
+
+from werkzeug.test import EnvironBuilder, run_wsgi_app
+
+
+def route_row(app, route):
+    for row in app.extensions['catbit']['traffic'].snapshot():
+        if row[0] == route:
+            return row
+    raise AssertionError(route)
+
+
+def test_counts_bytes_and_status_per_route(make_app):
+    app = make_app()
+    client = app.test_client()
+    body = json.dumps({'latitude': 1, 'longitude': 2}).encode('utf-8')
+
+    with client.post('/update_location', data=body, content_type='application/json') as resp:
+        first = len(resp.get_data())
+    with client.post('/update_location', data=body, content_type='application/json') as resp:
+        second = len(resp.get_data())
+    with client.get('/') as resp:
+        page = len(resp.get_data())
+
+    route, requests, request_bytes, response_bytes, status, rate = route_row(app, '/update_location')
+    assert (requests, request_bytes, response_bytes) == (2, 2 * len(body), first + second)
+    assert status == {200: 2}
+    assert sum(rate) == 2
+    assert route_row(app, '/')[1:4] == (1, 0, page)
+
+
+def test_unread_body_is_not_counted(make_app):
+    app = make_app()
+    # /send_data不读取请求体，声明的Content-Length不应计入
+    with app.test_client().post('/send_data', data=b'x' * 100) as resp:
+        assert resp.status_code == 200
+    assert route_row(app, '/send_data')[2] == 0
+
+
+def test_unmatched_requests_use_the_last_slot(make_app):
+    app = make_app()
+    client = app.test_client()
+    with client.get('/no-such-page') as resp:
+        size = len(resp.get_data())
+        assert resp.status_code == 404
+
+    traffic = app.extensions['catbit']['traffic']
+    row = traffic.snapshot()[traffic.unmatched]
+    assert row[0] == '(未匹配)'
+    assert row[1:5] == (1, 0, size, {404: 1})
+
+
+def test_chunked_upload_counts_bytes_read(make_app):
+    app = make_app()
+    body = json.dumps({'latitude': 1, 'longitude': 2}).encode('utf-8')
+    environ = EnvironBuilder(path='/update_location', method='POST',
+                             content_type='application/json').get_environ()
+    # 分块上传没有Content-Length，只能按实际读取的字节数统计
+    environ.pop('CONTENT_LENGTH', None)
+    environ['HTTP_TRANSFER_ENCODING'] = 'chunked'
+    environ['wsgi.input_terminated'] = True
+    environ['wsgi.input'] = io.BytesIO(body)
+
+    app_iter, status, _ = run_wsgi_app(app, environ)
+    sent = len(b''.join(app_iter))
+    app_iter.close()
+
+    assert status == '200 OK'
+    assert route_row(app, '/update_location')[1:4] == (1, len(body), sent)
+
+
+def test_rate_window_rolls_over(catbit, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(catbit.time, 'time', lambda: now[0])
+    traffic = catbit.RouteTraffic([('index', '/')])
+
+    traffic.record('index', 200, 0, 0)
+    traffic.record('index', 200, 0, 0)
+    now[0] = 1001.0
+    traffic.record('index', 200, 0, 0)
+    rate = traffic.snapshot()[0][5]
+    assert len(rate) == catbit.RATE_WINDOW
+    assert rate[-2:] == [2, 1]
+
+    # 一个窗口之后复用同一槽位，旧的计数要先清零
+    now[0] = 1000.0 + catbit.RATE_WINDOW
+    traffic.record('index', 200, 0, 0)
+    rate = traffic.snapshot()[0][5]
+    assert rate[0] == 1 and rate[-1] == 1 and sum(rate) == 2
+    assert traffic.snapshot()[0][1] == 4
+
+    now[0] += 2 * catbit.RATE_WINDOW
+    assert sum(traffic.snapshot()[0][5]) == 0
+
+
+def test_traffic_disabled_leaves_wsgi_app_unwrapped(catbit, make_app, admin_client):
+    app = make_app(TRAFFIC_ENABLED=False)
+    assert not isinstance(app.wsgi_app, catbit.TrafficMiddleware)
+    assert app.extensions['catbit']['traffic'] is None
+    with admin_client(app).get('/admin/api/data') as resp:
+        assert resp.get_json()['routes'] == []
+
+    assert isinstance(make_app().wsgi_app, catbit.TrafficMiddleware)